@@ -5,9 +5,19 @@ A production-ready API wrapper for Strands agents with tools
 
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, ConfigDict
 from typing import Optional, List, Dict, Any
 import os
+import time
+import secrets
+import asyncio
+import hashlib
+import tiktoken
+import orjson
+from cachetools import TTLCache
 from contextlib import asynccontextmanager
 
 # Import Strands
@@ -15,14 +25,56 @@ from strands import Agent, tool
 from strands.models.openai import OpenAIModel
 from strands_tools import calculator, current_time
 
-# Global agent instance
-agent_instance = None
+# Static system prompt, kept byte-identical across requests and workers so
+# it forms a stable prefix for OpenAI prompt caching
+SYSTEM_PROMPT = """You are a helpful AI assistant with access to:
+- calculator: Perform mathematical calculations
+- current_time: Get the current date and time
+- send_sms: Send SMS messages
+
+Be friendly, concise, and use tools when appropriate."""
+
+# Strands agents reject overlapping invocations (ConcurrencyException), so
+# calls into the single agent are serialized; the event loop stays free
+# while a call runs in the threadpool
+agent_lock = asyncio.Lock()
+
+# Set to 1 to send a throwaway prompt through the agent at startup so the
+# first real request doesn't pay for cold-start initialization
+AGENT_WARMUP = os.environ.get("AGENT_WARMUP", "0") == "1"
+
+# Reply cache keyed by (session_id, message) so retried or replayed
+# /chat requests skip the model round-trip
+CACHE_ENABLED = os.environ.get("CACHE_ENABLED", "0") == "1"
+reply_cache = TTLCache(maxsize=1024, ttl=300)
+reply_cache_lock = asyncio.Lock()
+
+def reply_cache_key(session_id: Optional[str], message: str) -> bytes:
+    """Hash a (session_id, message) pair into a compact cache key"""
+    return hashlib.blake2b(
+        f"{session_id}\0{message}".encode(),
+        digest_size=16
+    ).digest()
+
+def count_tokens(text: str) -> int:
+    """Count tokens in text, treating special-token strings as plain text"""
+    encoding = app.state.encoding
+    if encoding is None:
+        return len(text.split())
+    return len(encoding.encode_ordinary(text))
+
+def result_text(result: Any) -> str:
+    """Convert an agent result to text once, skipping str() for plain strings"""
+    return result if isinstance(result, str) else str(result)
+
+async def call_agent(*args, **kwargs):
+    """Run the agent in the threadpool, one call at a time"""
+    async with agent_lock:
+        return await run_in_threadpool(app.state.run_agent, *args, **kwargs)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Initialize agent on startup"""
-    global agent_instance
-    
     # Get API key from environment
     openai_api_key = os.environ.get('OPENAI_API_KEY')
     if not openai_api_key:
@@ -45,7 +97,7 @@ async def lifespan(app: FastAPI):
         return f"SMS sent to {phone}: {message}"
     
     # Create agent with tools
-    agent_instance = Agent(
+    agent = Agent(
         model=OpenAIModel(
             client_args={"api_key": openai_api_key},
             model_id="gpt-4o-mini",
@@ -55,14 +107,34 @@ async def lifespan(app: FastAPI):
             }
         ),
         tools=[calculator, current_time, send_sms],
-        system_prompt="""You are a helpful AI assistant with access to:
-        - calculator: Perform mathematical calculations
-        - current_time: Get the current date and time
-        - send_sms: Send SMS messages
-        
-        Be friendly, concise, and use tools when appropriate."""
+        system_prompt=SYSTEM_PROMPT
     )
     
+    # Bind the agent once; handlers and call_agent read it from app.state
+    app.state.run_agent = agent
+    
+    # Tokenizer for usage accounting in the OpenAI-compatible endpoint.
+    # tiktoken downloads its BPE file on first use, so don't fail startup
+    # when it is unreachable; usage falls back to a word count instead
+    try:
+        app.state.encoding = tiktoken.encoding_for_model("gpt-4o-mini")
+        app.state.encoding.encode_ordinary("warm-up")
+    except Exception as e:
+        app.state.encoding = None
+        print(f"⚠️  Warning: tokenizer unavailable, estimating usage by word count: {e}")
+    
+    if AGENT_WARMUP:
+        try:
+            await call_agent("Hello")
+        except Exception as e:
+            print(f"⚠️  Warning: agent warm-up failed: {e}")
+        else:
+            print("✓ Agent warmed up")
+        finally:
+            # Don't leak the warm-up exchange into real conversations,
+            # including a half-finished one from a failed call
+            agent.messages.clear()
+    
     print("✓ Strands agent initialized")
     yield
     print("✓ Shutting down")
@@ -72,18 +144,33 @@ app = FastAPI(
     title="Strands Agent API",
     description="AI agent with tools powered by Strands",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
-# Add CORS middleware
+# Set by lifespan once the agent is built
+app.state.run_agent = None
+
+# Add CORS middleware with an explicit origin allowlist
+CORS_ORIGINS = [
+    origin.strip()
+    for origin in os.environ.get("CORS_ORIGINS", "http://localhost:3000").split(",")
+    if origin.strip()
+]
+
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=CORS_ORIGINS,
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST"],
+    allow_headers=["content-type", "authorization"],
+    max_age=86400,
 )
 
+# Compress larger payloads such as chat completions; adds
+# "Vary: Accept-Encoding". HTTP/2 is terminated at Railway's edge.
+app.add_middleware(GZipMiddleware, minimum_size=512)
+
 # Request/Response models
 class ChatRequest(BaseModel):
     message: str
@@ -95,10 +182,15 @@ class ChatResponse(BaseModel):
 
 # OpenAI-compatible models
 class Message(BaseModel):
+    # Open WebUI sends extra fields (name, tool_calls) the agent never reads
+    model_config = ConfigDict(extra="ignore")
+    
     role: str
     content: str
 
 class OpenAIChatRequest(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    
     model: str = "strands-agent"
     messages: List[Message]
     temperature: Optional[float] = 0.7
@@ -122,26 +214,53 @@ class HealthResponse(BaseModel):
     version: str
     agent_ready: bool
 
+# Pre-serialized payloads for configuration-constant endpoints
+TOOLS_JSON = orjson.dumps([
+    {
+        "name": "calculator",
+        "description": "Perform mathematical calculations and evaluate expressions"
+    },
+    {
+        "name": "current_time",
+        "description": "Get the current date and time"
+    },
+    {
+        "name": "send_sms",
+        "description": "Send SMS messages via Twilio"
+    }
+])
+
+HEALTH_JSON = {
+    ready: orjson.dumps({
+        "status": "healthy",
+        "version": "1.0.0",
+        "agent_ready": ready
+    })
+    for ready in (True, False)
+}
+
+# /v1/models is rebuilt only when its "created" timestamp is stale
+MODELS_TTL = 60
+models_cache = {"created": 0, "body": b""}
+
 # Routes
-@app.get("/", response_model=HealthResponse)
+@app.get("/", responses={200: {"model": HealthResponse}})
 async def root():
     """Health check endpoint"""
-    return {
-        "status": "healthy",
-        "version": "1.0.0",
-        "agent_ready": agent_instance is not None
-    }
+    return Response(
+        content=HEALTH_JSON[app.state.run_agent is not None],
+        media_type="application/json"
+    )
 
-@app.get("/health", response_model=HealthResponse)
+@app.get("/health", responses={200: {"model": HealthResponse}})
 async def health():
     """Detailed health check"""
-    return {
-        "status": "healthy",
-        "version": "1.0.0",
-        "agent_ready": agent_instance is not None
-    }
+    return Response(
+        content=HEALTH_JSON[app.state.run_agent is not None],
+        media_type="application/json"
+    )
 
-@app.post("/chat", response_model=ChatResponse)
+@app.post("/chat", responses={200: {"model": ChatResponse}})
 async def chat(request: ChatRequest):
     """
     Chat with the Strands agent
@@ -151,40 +270,42 @@ async def chat(request: ChatRequest):
     - Current time/date information
     - SMS sending capabilities
     """
-    if not agent_instance:
+    if app.state.run_agent is None:
         raise HTTPException(status_code=503, detail="Agent not initialized")
     
+    if CACHE_ENABLED:
+        key = reply_cache_key(request.session_id, request.message)
+        async with reply_cache_lock:
+            cached = reply_cache.get(key)
+        if cached is not None:
+            return ORJSONResponse({
+                "response": cached,
+                "session_id": request.session_id
+            })
+    
     try:
         # Run the agent
-        result = agent_instance(
+        result = await call_agent(
             request.message,
             session_id=request.session_id
         )
+        response_text = result_text(result)
+        
+        if CACHE_ENABLED:
+            async with reply_cache_lock:
+                reply_cache[key] = response_text
         
-        return {
-            "response": str(result),
+        return ORJSONResponse({
+            "response": response_text,
             "session_id": request.session_id
-        }
+        })
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Agent error: {str(e)}")
 
-@app.get("/tools", response_model=List[ToolInfo])
+@app.get("/tools", responses={200: {"model": List[ToolInfo]}})
 async def list_tools():
     """List available tools"""
-    return [
-        {
-            "name": "calculator",
-            "description": "Perform mathematical calculations and evaluate expressions"
-        },
-        {
-            "name": "current_time",
-            "description": "Get the current date and time"
-        },
-        {
-            "name": "send_sms",
-            "description": "Send SMS messages via Twilio"
-        }
-    ]
+    return Response(content=TOOLS_JSON, media_type="application/json")
 
 @app.post("/chat/simple")
 async def chat_simple(message: str):
@@ -192,42 +313,97 @@ async def chat_simple(message: str):
     Simple chat endpoint (query parameter)
     Example: POST /chat/simple?message=Hello
     """
-    if not agent_instance:
+    if app.state.run_agent is None:
         raise HTTPException(status_code=503, detail="Agent not initialized")
     
     try:
-        result = agent_instance(message)
-        return {"response": str(result)}
+        result = await call_agent(message)
+        return ORJSONResponse({"response": result_text(result)})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Agent error: {str(e)}")
 
-@app.post("/v1/chat/completions", response_model=OpenAIChatResponse)
+async def stream_completion(agent: Agent, message: str, model: str):
+    """Yield OpenAI-style chat.completion.chunk events as Server-Sent Events"""
+    completion_id = f"chatcmpl-{secrets.token_hex(4)}"
+    created = int(time.time())
+    
+    def chunk(delta: Dict[str, Any], finish_reason: Optional[str] = None) -> bytes:
+        return b"data: " + orjson.dumps({
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [
+                {
+                    "index": 0,
+                    "delta": delta,
+                    "finish_reason": finish_reason
+                }
+            ]
+        }) + b"\n\n"
+    
+    yield chunk({"role": "assistant"})
+    try:
+        # Hold the agent for the whole stream, like call_agent does
+        async with agent_lock:
+            async for event in agent.stream_async(
+                message,
+                session_id="openai-compat"
+            ):
+                if "data" in event:
+                    yield chunk({"content": event["data"]})
+    except Exception as e:
+        # Headers are already sent, so report the failure in-band
+        yield b"data: " + orjson.dumps({
+            "error": {"message": f"Agent error: {str(e)}"}
+        }) + b"\n\n"
+    else:
+        yield chunk({}, "stop")
+    yield b"data: [DONE]\n\n"
+
+@app.post("/v1/chat/completions", responses={200: {"model": OpenAIChatResponse}})
 async def openai_chat_completions(request: OpenAIChatRequest):
     """
     OpenAI-compatible chat completions endpoint
     Compatible with Open WebUI and other OpenAI clients
     """
-    if not agent_instance:
+    if app.state.run_agent is None:
         raise HTTPException(status_code=503, detail="Agent not initialized")
     
+    # Extract the last user message
+    last_message = next(
+        (msg.content for msg in reversed(request.messages) if msg.role == "user"),
+        None
+    )
+    if last_message is None:
+        raise HTTPException(status_code=400, detail="No user message found")
+    
+    if request.stream:
+        return StreamingResponse(
+            stream_completion(app.state.run_agent, last_message, request.model),
+            media_type="text/event-stream",
+            headers={
+                "Cache-Control": "no-cache",
+                # Keep GZipMiddleware from buffering the event stream
+                "Content-Encoding": "identity"
+            }
+        )
+    
     try:
-        # Extract the last user message
-        user_messages = [msg for msg in request.messages if msg.role == "user"]
-        if not user_messages:
-            raise HTTPException(status_code=400, detail="No user message found")
-        
-        last_message = user_messages[-1].content
-        
         # Run the agent
-        result = agent_instance(last_message, session_id="openai-compat")
-        response_text = str(result)
+        result = await call_agent(
+            last_message,
+            session_id="openai-compat"
+        )
+        response_text = result_text(result)
         
-        # Build OpenAI-compatible response
-        import time
-        import uuid
+        # Count tokens with the model's tokenizer
+        prompt_tokens = count_tokens(last_message)
+        completion_tokens = count_tokens(response_text)
         
-        return {
-            "id": f"chatcmpl-{uuid.uuid4().hex[:8]}",
+        # Build OpenAI-compatible response
+        return ORJSONResponse({
+            "id": f"chatcmpl-{secrets.token_hex(4)}",
             "object": "chat.completion",
             "created": int(time.time()),
             "model": request.model,
@@ -242,11 +418,11 @@ async def openai_chat_completions(request: OpenAIChatRequest):
                 }
             ],
             "usage": {
-                "prompt_tokens": len(last_message.split()),
-                "completion_tokens": len(response_text.split()),
-                "total_tokens": len(last_message.split()) + len(response_text.split())
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
             }
-        }
+        })
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Agent error: {str(e)}")
 
@@ -256,24 +432,38 @@ async def list_models():
     OpenAI-compatible models endpoint
     Lists available models for Open WebUI
     """
-    import time
+    now = int(time.time())
+    if now - models_cache["created"] > MODELS_TTL:
+        models_cache["created"] = now
+        models_cache["body"] = orjson.dumps({
+            "object": "list",
+            "data": [
+                {
+                    "id": "strands-agent",
+                    "object": "model",
+                    "created": now,
+                    "owned_by": "strands",
+                    "permission": [],
+                    "root": "strands-agent",
+                    "parent": None
+                }
+            ]
+        })
     
-    return {
-        "object": "list",
-        "data": [
-            {
-                "id": "strands-agent",
-                "object": "model",
-                "created": int(time.time()),
-                "owned_by": "strands",
-                "permission": [],
-                "root": "strands-agent",
-                "parent": None
-            }
-        ]
-    }
+    return Response(content=models_cache["body"], media_type="application/json")
 
 if __name__ == "__main__":
     import uvicorn
     port = int(os.environ.get("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+    # App must be passed as an import string for uvicorn to spawn workers;
+    # each worker runs lifespan and builds its own agent instance, so
+    # conversation history is per worker.
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=port,
+        workers=workers,
+        loop="uvloop",
+        http="httptools"
+    )
@@ -15,6 +15,10 @@ fi
 echo "📦 Installing dependencies..."
 pip install -q -r requirements.txt
 
+# Make sure the app module imports cleanly before starting
+echo "🔍 Checking main.py imports..."
+python -c "import main" || exit 1
+
 # Start the server
 echo ""
 echo "✓ Starting server on http://localhost:8000"